@@ -1,17 +1,28 @@
 import os
 import numpy as np
 import tensorflow as tf
+from scipy import sparse
 from sklearn.feature_extraction.text import TfidfVectorizer
 import pickle
 from datetime import datetime
 import json
 
+# Spam indicators (simple heuristics), each one found adds to the spam score
+SPAM_PHRASES = (
+    "you've won", "congratulations! you won", "lottery winner", 
+    "million dollars", "nigeria", "inheritance", "wire transfer",
+    "bank details", "urgent business", "forex", "investment opportunity",
+    "unclaimed", "hot singles", "meet singles", "enlargement", "viagra",
+    "pharmacy", "pills", "discount meds", "casino", "betting", "gambling"
+)
+
 class EmailClassifier:
     def __init__(self, model_dir='model_data'):
         """Initialize the email classifier model"""
         self.model_dir = model_dir
         self.vectorizer_path = os.path.join(model_dir, 'vectorizer.pkl')
         self.model_path = os.path.join(model_dir, 'email_model')
+        self.tflite_model_path = os.path.join(model_dir, 'email_model.tflite')
         
         # Create model directory if it doesn't exist
         if not os.path.exists(model_dir):
@@ -20,12 +31,27 @@ class EmailClassifier:
         # Initialize the vectorizer
         self.vectorizer = self._load_or_create_vectorizer()
         
+        # Fitted status only changes in fit_vectorizer, so check it once here
+        self._vectorizer_fitted = hasattr(self.vectorizer, 'vocabulary_')
+        
         # Initialize the model
         self.model = self._load_or_create_model()
         
-        # Training data storage
+        # TFLite copy of the model, used for inference
+        self.interpreter = self._load_or_create_interpreter()
+        
+        # Training data storage: metadata as JSON, features and labels as raw
+        # arrays that retrain_model maps straight from disk
         self.training_data_path = os.path.join(model_dir, 'training_data.json')
+        self.features_path = os.path.join(model_dir, 'features.dat')
+        self.labels_path = os.path.join(model_dir, 'labels.dat')
+        self.feature_dtype = np.float32
+        self.label_dtype = np.int8
         self.training_data = self._load_training_data()
+        
+        # Running totals for get_training_stats, updated in add_training_example
+        self._important_count = sum(1 for example in self.training_data if example['is_important'])
+        self._last_example_ts = max((example['timestamp'] for example in self.training_data), default=None)
     
     def _load_or_create_vectorizer(self):
         """Load the existing TF-IDF vectorizer or create a new one"""
@@ -66,37 +92,159 @@ class EmailClassifier:
             
             return model
     
+    def _load_or_create_interpreter(self):
+        """Load the TFLite version of the model, converting the Keras model if needed"""
+        if not os.path.exists(self.model_path):
+            # The model has never been saved, so it is a fresh random one that
+            # is rebuilt on every launch; convert it without saving the result
+            interpreter = tf.lite.Interpreter(model_content=self._convert_to_tflite())
+        else:
+            # Regenerate the TFLite copy if it is missing or older than the model
+            if (not os.path.exists(self.tflite_model_path)
+                    or os.path.getmtime(self.tflite_model_path) < self._model_mtime()):
+                self._save_tflite_model()
+            interpreter = tf.lite.Interpreter(model_path=self.tflite_model_path)
+        
+        interpreter.allocate_tensors()
+        
+        return interpreter
+    
+    def _model_mtime(self):
+        """Last modification time of the saved Keras model (a file or a SavedModel directory)"""
+        mtimes = [
+            os.path.getmtime(os.path.join(root, name))
+            for root, dirs, files in os.walk(self.model_path)
+            for name in files
+        ]
+        return max(mtimes, default=os.path.getmtime(self.model_path))
+    
+    def _convert_to_tflite(self):
+        """Convert the current Keras model to a TFLite flatbuffer"""
+        converter = tf.lite.TFLiteConverter.from_keras_model(self.model)
+        return converter.convert()
+    
+    def _save_tflite_model(self):
+        """Convert the current Keras model to TFLite and save it to disk"""
+        tflite_model = self._convert_to_tflite()
+        
+        # Write to a temporary file first so a crash never leaves a partial model
+        temp_path = self.tflite_model_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(tflite_model)
+        os.replace(temp_path, self.tflite_model_path)
+    
+    def _run_model(self, features):
+        """Run the TFLite model on a 2D feature array and return its output"""
+        # Use one interpreter throughout, even if retraining replaces it meanwhile
+        interpreter = self.interpreter
+        input_details = interpreter.get_input_details()[0]
+        output_details = interpreter.get_output_details()[0]
+        
+        # Only reallocate when the batch size changes
+        if input_details['shape'][0] != len(features):
+            interpreter.resize_tensor_input(input_details['index'], features.shape)
+            interpreter.allocate_tensors()
+        
+        interpreter.set_tensor(input_details['index'], features.astype(np.float32, copy=False))
+        interpreter.invoke()
+        
+        return interpreter.get_tensor(output_details['index'])
+    
     def _load_training_data(self):
         """Load existing training data or initialize an empty list"""
         if os.path.exists(self.training_data_path):
             with open(self.training_data_path, 'r') as f:
-                return json.load(f)
+                training_data = json.load(f)
         else:
             return []
+        
+        # Older versions stored the features of every example in the JSON file
+        if training_data and 'features' in training_data[0]:
+            training_data = self._migrate_training_features(training_data)
+        
+        return training_data
+    
+    def _migrate_training_features(self, training_data):
+        """Move features stored in the JSON training data into the feature arrays"""
+        features = np.array([example.pop('features') for example in training_data], dtype=self.feature_dtype)
+        labels = np.array([1 if example['is_important'] else 0 for example in training_data], dtype=self.label_dtype)
+        
+        features.tofile(self.features_path)
+        labels.tofile(self.labels_path)
+        
+        with open(self.training_data_path, 'w') as f:
+            json.dump(training_data, f)
+        
+        return training_data
     
     def _save_training_data(self):
         """Save the current training data to disk"""
         with open(self.training_data_path, 'w') as f:
             json.dump(self.training_data, f)
     
+    def _count_training_rows(self, n_features):
+        """
+        Count the training rows that are complete in both arrays and recorded
+        in the JSON metadata
+        """
+        row_bytes = n_features * np.dtype(self.feature_dtype).itemsize
+        label_bytes = np.dtype(self.label_dtype).itemsize
+        
+        n_rows = len(self.training_data)
+        for path, item_bytes in ((self.features_path, row_bytes), (self.labels_path, label_bytes)):
+            n_rows = min(n_rows, os.path.getsize(path) // item_bytes if os.path.exists(path) else 0)
+        
+        return n_rows
+    
+    def _append_training_arrays(self, features, label):
+        """Append one feature row and its label to the on-disk training arrays"""
+        features = np.asarray(features, dtype=self.feature_dtype)
+        
+        # A crash between (or during) the two appends, or before the metadata
+        # was saved, leaves stray bytes at the end of the files. Cut both back
+        # to their common complete rows so new rows and labels stay aligned.
+        n_rows = self._count_training_rows(features.size)
+        for path, item_bytes in ((self.features_path, features.nbytes),
+                                 (self.labels_path, np.dtype(self.label_dtype).itemsize)):
+            if os.path.exists(path):
+                os.truncate(path, n_rows * item_bytes)
+        
+        with open(self.features_path, 'ab') as f:
+            features.tofile(f)
+        with open(self.labels_path, 'ab') as f:
+            np.array([label], dtype=self.label_dtype).tofile(f)
+    
+    def _map_training_arrays(self):
+        """Memory-map the stored training features and labels as (X, y)"""
+        n_features = self.model.input_shape[-1]
+        n_rows = self._count_training_rows(n_features)
+        
+        X = np.memmap(self.features_path, dtype=self.feature_dtype, mode='r', shape=(n_rows, n_features))
+        y = np.memmap(self.labels_path, dtype=self.label_dtype, mode='r', shape=(n_rows,))
+        
+        return X, y
+    
     def _save_vectorizer(self):
         """Save the current vectorizer to disk"""
         with open(self.vectorizer_path, 'wb') as f:
             pickle.dump(self.vectorizer, f)
     
     def _save_model(self):
-        """Save the current model to disk"""
+        """Save the current model to disk and refresh the TFLite copy"""
         self.model.save(self.model_path)
+        self._save_tflite_model()
+        self.interpreter = self._load_or_create_interpreter()
     
     def fit_vectorizer(self, email_bodies):
         """Fit the vectorizer on a corpus of email bodies"""
         self.vectorizer.fit(email_bodies)
+        self._vectorizer_fitted = True
         self._save_vectorizer()
     
     def vectorize_text(self, email_body):
         """Convert email body text to TF-IDF vector"""
         # Check if the vectorizer is already fitted
-        if not hasattr(self.vectorizer, 'vocabulary_'):
+        if not self._vectorizer_fitted:
             # If not fitted, we'll return zeros for now
             # In a real application, you'd want to handle this better
             return np.zeros(5000)
@@ -130,27 +278,48 @@ class EmailClassifier:
         
         return features
     
+    def prepare_features_batch(self, email_data_list):
+        """
+        Prepare a feature matrix for a list of emails
+        
+        email_data_list: List of dictionaries in the format of prepare_features
+        
+        The bodies are vectorized in a single transform call and kept sparse
+        until the final matrix is built, so the batch is densified only once.
+        """
+        # Vectorize all email bodies at once
+        if not self._vectorizer_fitted:
+            # Same fallback as vectorize_text: all-zero text features
+            text_matrix = sparse.csr_matrix((len(email_data_list), 5000))
+        else:
+            text_matrix = self.vectorizer.transform([email_data['body'] for email_data in email_data_list])
+        
+        # Create additional features, one row per email
+        additional_features = np.array([
+            [
+                1 if email_data['contains_unsubscribe'] else 0,
+                email_data['sender_frequency'],
+                email_data['user_response_rate']
+            ]
+            for email_data in email_data_list
+        ], dtype=float)
+        
+        # Combine all features and densify the whole batch in one step
+        features = sparse.hstack(
+            [text_matrix, sparse.csr_matrix(additional_features)],
+            format='csr',
+            dtype=np.float32
+        )
+        
+        return features.toarray()
+    
     def predict_spam_likelihood(self, email_data):
         """
         Predict whether an email is likely spam based on features
         This is a simplified approach - in a real app you'd train a dedicated spam model
         """
-        # Spam indicators (simple heuristics)
-        spam_score = 0.0
-        
-        # Check for common spam indicators in the body
-        body = email_data['body'].lower()
-        spam_phrases = [
-            "you've won", "congratulations! you won", "lottery winner", 
-            "million dollars", "nigeria", "inheritance", "wire transfer",
-            "bank details", "urgent business", "forex", "investment opportunity",
-            "unclaimed", "hot singles", "meet singles", "enlargement", "viagra",
-            "pharmacy", "pills", "discount meds", "casino", "betting", "gambling"
-        ]
-        
-        for phrase in spam_phrases:
-            if phrase in body:
-                spam_score += 0.2  # Each spam phrase increases the score
+        # Each distinct spam phrase increases the score
+        spam_score = 0.2 * self._count_spam_phrases(email_data['body'])
         
         # Cap the score at 1.0
         spam_score = min(spam_score, 1.0)
@@ -159,6 +328,33 @@ class EmailClassifier:
         is_spam = spam_score > 0.3  # Threshold for spam classification
         
         return is_spam, spam_score
+    
+    def predict_spam_likelihood_batch(self, email_data_list):
+        """
+        Predict spam likelihood for a list of emails, scored together
+        
+        Returns: (is_spam, spam_scores)
+            - is_spam: boolean array, one entry per email
+            - spam_scores: float array of scores (0-1)
+        """
+        phrase_counts = np.fromiter(
+            (self._count_spam_phrases(email_data['body']) for email_data in email_data_list),
+            dtype=float,
+            count=len(email_data_list)
+        )
+        
+        # Same scoring and threshold as predict_spam_likelihood
+        spam_scores = np.minimum(0.2 * phrase_counts, 1.0)
+        is_spam = spam_scores > 0.3
+        
+        return is_spam, spam_scores
+    
+    def _count_spam_phrases(self, body):
+        """Count the spam phrases (simple heuristics) found in an email body"""
+        # Plain substring checks: each is a fast C-level search, and unlike a
+        # regex alternation they also find phrases that overlap one another
+        body = body.lower()
+        return sum(phrase in body for phrase in SPAM_PHRASES)
 
     def predict_importance(self, email_data):
         """
@@ -171,13 +367,36 @@ class EmailClassifier:
         features = self.prepare_features(email_data)
         
         # Make prediction
-        score = self.model.predict(features.reshape(1, -1))[0][0]
+        score = self._run_model(features.reshape(1, -1))[0][0]
         
         # Threshold for classification (can be tuned)
         is_important = score > 0.5
         
         return is_important, float(score)
     
+    def predict_importance_batch(self, email_data_list):
+        """
+        Predict importance for a list of emails with a single model call
+        
+        email_data_list: List of dictionaries in the format of prepare_features
+        
+        Returns: (is_important, importance_scores)
+            - is_important: boolean array, one entry per email
+            - importance_scores: float array of confidence scores (0-1)
+        """
+        if not email_data_list:
+            return np.zeros(0, dtype=bool), np.zeros(0)
+        
+        features = self.prepare_features_batch(email_data_list)
+        
+        # One predict call for the whole batch instead of one per email
+        scores = self._run_model(features).ravel()
+        
+        # Same threshold as predict_importance
+        is_important = scores > 0.5
+        
+        return is_important, scores
+    
     def add_training_example(self, email_data, is_important):
         """
         Add a new training example
@@ -188,15 +407,20 @@ class EmailClassifier:
         # Get features
         features = self.prepare_features(email_data)
         
-        # Store email data with user feedback
+        # Store the features on disk and the feedback metadata as JSON
+        self._append_training_arrays(features, 1 if is_important else 0)
+        
         example = {
-            'features': features.tolist(),
             'is_important': is_important,
             'timestamp': datetime.now().isoformat()
         }
         
         self.training_data.append(example)
         self._save_training_data()
+        
+        if is_important:
+            self._important_count += 1
+        self._last_example_ts = example['timestamp']
     
     def retrain_model(self, min_examples=20):
         """
@@ -209,9 +433,8 @@ class EmailClassifier:
         if len(self.training_data) < min_examples:
             return False
         
-        # Prepare training data
-        X = np.array([example['features'] for example in self.training_data])
-        y = np.array([1 if example['is_important'] else 0 for example in self.training_data])
+        # Map the training data straight from disk
+        X, y = self._map_training_arrays()
         
         # Retrain the model
         history = self.model.fit(
@@ -238,18 +461,14 @@ class EmailClassifier:
                 'last_retrain': None
             }
         
-        important_count = sum(1 for example in self.training_data if example['is_important'])
-        
-        # Sort by timestamp and get the most recent
-        self.training_data.sort(key=lambda x: x['timestamp'])
-        last_timestamp = self.training_data[-1]['timestamp']
+        important_count = self._important_count
         
         return {
             'total_examples': total,
             'important_count': important_count,
             'unimportant_count': total - important_count,
             'important_ratio': important_count / total,
-            'last_example_added': last_timestamp
+            'last_example_added': self._last_example_ts
         }
 
 # Example usage
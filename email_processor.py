@@ -1,29 +1,72 @@
 import os
 import json
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from gmail_client import GmailClient
 from ai_model import EmailClassifier
 
+# Emails fetched per batched Gmail request, and how many requests run at once
+# (kept low as Gmail rate-limits concurrent requests per user)
+FETCH_BATCH_SIZE = 50
+FETCH_WORKERS = 3
+
+# Emails classified per importance model call
+PREDICT_BATCH_SIZE = 64
+
+# Extracted features kept in memory for the most recently processed emails,
+# about one run of the UI (20 emails by default) as each holds a decoded body
+FEATURE_CACHE_SIZE = 64
+
+@dataclass(frozen=True)
+class EmailResult:
+    """Classification result and chosen action for one processed email"""
+    # Declared by hand since dataclass(slots=True) needs Python 3.10
+    __slots__ = ('message_id', 'sender', 'subject', 'is_important', 'importance_score', 'spam_score', 'action')
+    
+    message_id: str
+    sender: str
+    subject: str
+    is_important: bool
+    importance_score: float
+    spam_score: float
+    action: str
+
 class EmailProcessor:
     def __init__(self, data_dir='app_data'):
         """Initialize the email processor"""
         self.data_dir = data_dir
         self.sender_history_path = os.path.join(data_dir, 'sender_history.json')
-        self.processed_emails_path = os.path.join(data_dir, 'processed_emails.json')
+        self.processed_emails_path = os.path.join(data_dir, 'processed_emails.jsonl')
+        self.legacy_processed_emails_path = os.path.join(data_dir, 'processed_emails.json')
         
         # Create data directory if it doesn't exist
         if not os.path.exists(data_dir):
             os.makedirs(data_dir)
         
+        # Gmail label applied to every email once it has been processed
+        self.processed_label = 'AI-Processed'
+        
         # Initialize components
         self.gmail_client = GmailClient()
         self.email_classifier = EmailClassifier()
         
         # Load sender history
         self.sender_history = self._load_sender_history()
+        self._sender_dirty = False
         
         # Load processed emails record
         self.processed_emails = self._load_processed_emails()
+        
+        # Number of emails per action, kept up to date as emails are processed
+        self.action_counts = Counter(record['action'] for record in self.processed_emails.values())
+        
+        # Features of recently processed emails by message ID, least recently
+        # used first, so feedback doesn't fetch and extract them again
+        self._features_cache = OrderedDict()
+        self._features_cache_lock = threading.Lock()
     
     def _load_sender_history(self):
         """Load sender history from file or create a new one"""
@@ -38,35 +81,85 @@ class EmailProcessor:
         with open(self.sender_history_path, 'w') as f:
             json.dump(self.sender_history, f, default=lambda o: str(o))
     
+    def _flush_sender_history(self):
+        """Save sender history to file if it changed since the last save"""
+        if self._sender_dirty:
+            self._save_sender_history()
+            self._sender_dirty = False
+    
     def _load_processed_emails(self):
-        """Load processed emails record from file or create a new one"""
+        """
+        Load processed emails record from file or create a new one
+        
+        The record is an append-only log with one JSON object per line; later
+        lines for the same message replace earlier ones. The log is compacted
+        here whenever it holds superseded or unreadable lines.
+        """
+        processed_emails = {}
+        line_count = 0
+        
         if os.path.exists(self.processed_emails_path):
             with open(self.processed_emails_path, 'r') as f:
-                return json.load(f)
-        else:
-            return {}
+                for line in f:
+                    if not line.strip():
+                        continue
+                    line_count += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Partially written line from an interrupted run
+                        continue
+                    processed_emails[record.pop('message_id')] = record
+        elif os.path.exists(self.legacy_processed_emails_path):
+            # Migrate the old single-file JSON record
+            with open(self.legacy_processed_emails_path, 'r') as f:
+                processed_emails = json.load(f)
+            line_count = None
+        
+        if line_count != len(processed_emails):
+            self._compact_processed_emails(processed_emails)
+        
+        return processed_emails
+    
+    def _compact_processed_emails(self, processed_emails):
+        """Rewrite the processed emails log with a single line per email"""
+        temp_path = self.processed_emails_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            for message_id, record in processed_emails.items():
+                f.write(json.dumps(dict(record, message_id=message_id), default=lambda o: str(o)) + '\n')
+        os.replace(temp_path, self.processed_emails_path)
     
-    def _save_processed_emails(self):
-        """Save processed emails record to file"""
-        with open(self.processed_emails_path, 'w') as f:
-            json.dump(self.processed_emails, f, default=lambda o: str(o))
+    def _append_processed_email(self, message_id):
+        """Append the current record of one processed email to the log"""
+        self._append_processed_emails([message_id])
+    
+    def _append_processed_emails(self, message_ids):
+        """Append the current records of several processed emails to the log in one write"""
+        lines = [
+            json.dumps(dict(self.processed_emails[message_id], message_id=message_id), default=lambda o: str(o)) + '\n'
+            for message_id in message_ids
+        ]
+        with open(self.processed_emails_path, 'a') as f:
+            f.writelines(lines)
     
     def _update_sender_history(self, sender, responded=False):
-        """Update history for a sender"""
+        """Update history for a sender (saved on the next _flush_sender_history)"""
+        now = datetime.now().isoformat()
+        
         if sender not in self.sender_history:
             self.sender_history[sender] = {
                 'email_count': 0,
                 'response_count': 0,
-                'last_email': datetime.now().isoformat(),
-                'first_seen': datetime.now().isoformat()
+                'last_email': now,
+                'first_seen': now
             }
         
         self.sender_history[sender]['email_count'] += 1
         if responded:
             self.sender_history[sender]['response_count'] += 1
         
-        self.sender_history[sender]['last_email'] = datetime.now().isoformat()
-        self._save_sender_history()
+        self.sender_history[sender]['last_email'] = now
+        self._sender_dirty = True
     
     def get_sender_statistics(self, sender):
         """Get statistics for a specific sender"""
@@ -93,9 +186,10 @@ class EmailProcessor:
         message_id = message['id']
         
         # Get message details
-        sender = self.gmail_client.get_header(message, 'From')
-        subject = self.gmail_client.get_header(message, 'Subject')
-        date = self.gmail_client.get_header(message, 'Date')
+        headers = self.gmail_client.get_headers(message)
+        sender = headers.get('From', "")
+        subject = headers.get('Subject', "")
+        date = headers.get('Date', "")
         body = self.gmail_client.get_email_body(message)
         
         # Check for unsubscribe text
@@ -115,109 +209,255 @@ class EmailProcessor:
             'user_response_rate': sender_stats['response_rate']
         }
     
-    def process_unread_emails(self, max_emails=200):
-        """Process unread emails from Gmail inbox"""
-        # Get unread messages (increased limit)
-        unread_messages = self.gmail_client.get_unread_messages(max_results=max_emails)
+    def _dummy_features(self):
+        """Placeholder email features in the format of extract_email_features"""
+        return {
+            'message_id': '',
+            'sender': '',
+            'subject': '',
+            'date': '',
+            'body': '',
+            'contains_unsubscribe': False,
+            'sender_frequency': 0,
+            'user_response_rate': 0.0
+        }
+    
+    def warm_up(self):
+        """Classify a full batch of placeholder emails so the first real batch doesn't pay one-off setup costs"""
+        dummy_batch = [self._dummy_features()] * PREDICT_BATCH_SIZE
+        self.email_classifier.predict_spam_likelihood_batch(dummy_batch)
+        self.email_classifier.predict_importance_batch(dummy_batch)
+    
+    def _features_for_message(self, message):
+        """Extract the features of a message and cache them by message ID"""
+        email_features = self.extract_email_features(message)
+        
+        with self._features_cache_lock:
+            self._features_cache[email_features['message_id']] = email_features
+            self._features_cache.move_to_end(email_features['message_id'])
+            while len(self._features_cache) > FEATURE_CACHE_SIZE:
+                self._features_cache.popitem(last=False)
+        
+        return email_features
+    
+    def _features_for(self, message_id):
+        """Get the features of a message, fetching and extracting them only if they aren't cached"""
+        with self._features_cache_lock:
+            email_features = self._features_cache.get(message_id)
+            if email_features is not None:
+                self._features_cache.move_to_end(message_id)
+                return email_features
+        
+        return self._features_for_message(self.gmail_client.get_message_details(message_id))
+    
+    def process_unread_emails(self, max_emails=200, on_results=None):
+        """
+        Process unread emails from Gmail inbox
+        
+        on_results: Optional callback called with the EmailResult objects of
+        each batch as soon as its actions are applied and recorded
+        """
+        # Get unread messages (increased limit), leaving out ones already labelled as processed
+        unread_messages = self.gmail_client.get_unread_messages(
+            max_results=max_emails,
+            query=f'is:unread -label:{self.processed_label}'
+        )
         
         if not unread_messages:
             return []
         
-        results = []
+        # Skip already processed emails (and duplicates across result pages)
+        message_ids = list(dict.fromkeys(
+            msg['id'] for msg in unread_messages if msg['id'] not in self.processed_emails
+        ))
         
-        # Create a progress counter
-        total_emails = len(unread_messages)
-        processed = 0
+        results = []
         
-        for msg in unread_messages:
-            # Skip already processed emails
-            if msg['id'] in self.processed_emails:
-                continue
-            
-            # Get full message details
-            message = self.gmail_client.get_message_details(msg['id'])
-            
-            # Extract features
-            email_features = self.extract_email_features(message)
-            
-            # Predict importance
-            is_important, importance_score = self.email_classifier.predict_importance(email_features)
-            
-            # Take action based on prediction
-            action = self._take_action(
-                message_id=email_features['message_id'],
-                is_important=is_important,
-                contains_unsubscribe=email_features['contains_unsubscribe']
-            )
+        # Fetch message details on worker threads while this thread classifies
+        # whatever has already arrived
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+            futures = [
+                executor.submit(
+                    self.gmail_client.get_messages_details_batch,
+                    message_ids[start:start + FETCH_BATCH_SIZE]
+                )
+                for start in range(0, len(message_ids), FETCH_BATCH_SIZE)
+            ]
             
+            try:
+                batch = []
+                for future in as_completed(futures):
+                    batch.extend(self._features_for_message(message) for message in future.result().values())
+                    
+                    while len(batch) >= PREDICT_BATCH_SIZE:
+                        results.extend(self._process_batch(batch[:PREDICT_BATCH_SIZE], on_results))
+                        batch = batch[PREDICT_BATCH_SIZE:]
+                
+                if batch:
+                    results.extend(self._process_batch(batch, on_results))
+            except Exception:
+                # Leaving the with block waits for every queued fetch, so drop the
+                # ones not yet started rather than wait for (and spend quota on)
+                # emails that would be thrown away
+                for future in futures:
+                    future.cancel()
+                raise
+        
+        # Report results in the order Gmail listed the emails
+        order = {message_id: index for index, message_id in enumerate(message_ids)}
+        results.sort(key=lambda result: order[result.message_id])
+        
+        return results
+    
+    def _process_batch(self, batch, on_results):
+        """
+        Classify a batch of emails, then apply and record the chosen actions
+        
+        Each batch is finished before the next one is classified, so an error
+        later in the run never leaves reported results unapplied or unrecorded.
+        Returns the EmailResult of each email in the batch.
+        """
+        action_buckets = {action: [] for action in ("marked_spam", "trashed", "marked_important", "archived")}
+        batch_results = self._classify_batch(batch, action_buckets)
+        
+        # Apply the actions in bulk, one request per action
+        self._apply_actions(action_buckets)
+        
+        for result in batch_results:
             # Update sender history
-            self._update_sender_history(email_features['sender'])
+            self._update_sender_history(result.sender)
             
             # Record the processed email
-            self.processed_emails[email_features['message_id']] = {
+            self.processed_emails[result.message_id] = {
                 'timestamp': datetime.now().isoformat(),
-                'is_important': is_important,
-                'importance_score': importance_score,
-                'action': action
+                'is_important': result.is_important,
+                'importance_score': result.importance_score,
+                'action': result.action
             }
+            self.action_counts[result.action] += 1
+        
+        # Record the whole batch with a single write to the log
+        self._append_processed_emails([result.message_id for result in batch_results])
+        
+        # Save sender history once for the whole batch
+        self._flush_sender_history()
+        
+        # Recorded emails are never fetched for processing again
+        self.gmail_client.forget_messages([result.message_id for result in batch_results])
+        
+        if on_results is not None:
+            on_results(batch_results)
+        
+        return batch_results
+    
+    def _classify_batch(self, batch, action_buckets):
+        """
+        Classify a batch of emails and choose an action for each
+        
+        The message ID of each email is added to its action's list in
+        action_buckets. Returns the EmailResult of each email in the batch.
+        """
+        # Run the cheap spam heuristic first so spam never reaches the model
+        spam_flags, spam_scores = self.email_classifier.predict_spam_likelihood_batch(batch)
+        nonspam_batch = [
+            email_features for email_features, is_spam in zip(batch, spam_flags) if not is_spam
+        ]
+        
+        # Predict importance for the remaining emails at once
+        important_flags, importance_scores = self.email_classifier.predict_importance_batch(nonspam_batch)
+        importance = dict(zip(
+            (email_features['message_id'] for email_features in nonspam_batch),
+            zip(important_flags, importance_scores)
+        ))
+        
+        results = []
+        for email_features, is_spam, spam_score in zip(batch, spam_flags, spam_scores):
+            is_spam = bool(is_spam)
+            if is_spam:
+                # Spam is never treated as important
+                is_important, importance_score = False, 0.0
+            else:
+                is_important, importance_score = importance[email_features['message_id']]
+                is_important = bool(is_important)
+                importance_score = float(importance_score)
             
-            # Save periodically (every 10 emails)
-            processed += 1
-            if processed % 10 == 0:
-                self._save_processed_emails()
+            # Choose action based on prediction
+            action = self._choose_action(email_features, is_spam, is_important)
+            action_buckets[action].append(email_features['message_id'])
             
             # Collect results
-            results.append({
-                'message_id': email_features['message_id'],
-                'sender': email_features['sender'],
-                'subject': email_features['subject'],
-                'is_important': is_important,
-                'importance_score': importance_score,
-                'action': action
-            })
-        
-        # Final save
-        self._save_processed_emails()
+            results.append(EmailResult(
+                message_id=email_features['message_id'],
+                sender=email_features['sender'],
+                subject=email_features['subject'],
+                is_important=is_important,
+                importance_score=importance_score,
+                spam_score=float(spam_score),
+                action=action
+            ))
         
         return results
     
-    def _take_action(self, message_id, is_important, contains_unsubscribe):
-        """Take action on an email based on its classification"""
-        # First check if it's spam
-        message = self.gmail_client.get_message_details(message_id)
-        email_features = self.extract_email_features(message)
-        
-        # Get spam prediction
-        is_spam, spam_score = self.email_classifier.predict_spam_likelihood(email_features)
-        
+    def _choose_action(self, email_features, is_spam, is_important):
+        """Choose the action to take on an email based on its classification"""
         if is_spam:
             # Move to spam folder
-            self.gmail_client.mark_as_spam(message_id)
             return "marked_spam"
-        elif not is_important and contains_unsubscribe:
+        elif not is_important and email_features['contains_unsubscribe']:
             # Move to trash for newsletters that are not important
-            self.gmail_client.trash_message(message_id)
             return "trashed"
         elif is_important:
             # Mark important emails
-            self.gmail_client.mark_as_important(message_id)
-            self.gmail_client.apply_label(message_id, "AI-Important")
             return "marked_important"
         else:
             # Archive other emails
-            self.gmail_client.archive_message(message_id)
             return "archived"
     
+    def _apply_actions(self, action_buckets):
+        """Apply the chosen actions in Gmail, given the message IDs for each action"""
+        if not any(action_buckets.values()):
+            return
+        
+        # Tag processed emails so later searches skip them. Trashed emails are
+        # left out of searches by Gmail anyway. The tag is only bookkeeping,
+        # so it is hidden from the label list and from messages.
+        processed_label_id = self.gmail_client.create_label(
+            self.processed_label,
+            label_list_visibility='labelHide',
+            message_list_visibility='hide'
+        )
+        
+        if action_buckets["marked_spam"]:
+            self.gmail_client.batch_modify_messages(
+                action_buckets["marked_spam"],
+                add_label_ids=['SPAM', processed_label_id],
+                remove_label_ids=['INBOX']
+            )
+        
+        if action_buckets["trashed"]:
+            self.gmail_client.trash_messages(action_buckets["trashed"])
+        
+        if action_buckets["marked_important"]:
+            label_id = self.gmail_client.create_label("AI-Important")
+            self.gmail_client.batch_modify_messages(
+                action_buckets["marked_important"],
+                add_label_ids=['IMPORTANT', label_id, processed_label_id]
+            )
+        
+        if action_buckets["archived"]:
+            self.gmail_client.batch_modify_messages(
+                action_buckets["archived"],
+                add_label_ids=[processed_label_id],
+                remove_label_ids=['INBOX']
+            )
+    
     def provide_feedback(self, message_id, is_actually_important):
         """Provide feedback to train the model"""
         if message_id not in self.processed_emails:
             return False
         
-        # Get the message details
-        message = self.gmail_client.get_message_details(message_id)
-        
-        # Extract features
-        email_features = self.extract_email_features(message)
+        # Get the features the email was classified with
+        email_features = self._features_for(message_id)
         
         # Add training example
         self.email_classifier.add_training_example(email_features, is_actually_important)
@@ -225,12 +465,13 @@ class EmailProcessor:
         # Update the processed email record
         self.processed_emails[message_id]['user_feedback'] = is_actually_important
         self.processed_emails[message_id]['feedback_time'] = datetime.now().isoformat()
-        self._save_processed_emails()
+        self._append_processed_email(message_id)
         
         # If the user indicated this sender is important, update the response rate
         sender = email_features['sender']
         if is_actually_important and sender in self.sender_history:
             self._update_sender_history(sender, responded=True)
+            self._flush_sender_history()
         
         return True
     
@@ -240,15 +481,6 @@ class EmailProcessor:
     
     def get_stats(self):
         """Get application statistics"""
-        # Count the number of emails in each action category
-        actions = {}
-        for email_id, data in self.processed_emails.items():
-            action = data['action']
-            if action in actions:
-                actions[action] += 1
-            else:
-                actions[action] = 1
-        
         # Get model training stats
         model_stats = self.email_classifier.get_training_stats()
         
@@ -257,7 +489,7 @@ class EmailProcessor:
         
         return {
             'processed_emails': len(self.processed_emails),
-            'actions': actions,
+            'actions': dict(self.action_counts),
             'unique_senders': unique_senders,
             'model_stats': model_stats
         }
@@ -271,10 +503,10 @@ if __name__ == "__main__":
     
     # Print results
     for result in results:
-        print(f"Email: {result['subject']}")
-        print(f"From: {result['sender']}")
-        print(f"Importance score: {result['importance_score']:.2f}")
-        print(f"Action taken: {result['action']}")
+        print(f"Email: {result.subject}")
+        print(f"From: {result.sender}")
+        print(f"Importance score: {result.importance_score:.2f}")
+        print(f"Action taken: {result.action}")
         print("---")
     
     # Print stats
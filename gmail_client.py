@@ -1,18 +1,53 @@
 import os
 import pickle
+import random
+import threading
+import time
+from collections import OrderedDict
+import google_auth_httplib2
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
-import base64
+from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
+import binascii
 import email
 from datetime import datetime
 
+URLSAFE_TO_STANDARD_BASE64 = str.maketrans('-_', '+/')
+
+# Batched calls failing with these statuses (rate limiting, server errors)
+# are retried with exponential backoff, up to BATCH_RETRIES times
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+# Gmail also reports rate limiting as 403 with one of these reasons
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+BATCH_RETRIES = 5
+
 class GmailClient:
     def __init__(self):
         # If modifying these scopes, delete the token.pickle file
         self.SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
+        # Only request the parts of a message we actually read (headers and body data)
+        self.MESSAGE_FIELDS = 'id,payload(headers,parts(mimeType,body/data,parts(mimeType,body/data)),body/data)'
+        # Only the start of a body is needed for classification, plus its end,
+        # where footers such as unsubscribe links are
+        self.MAX_BODY_BYTES = 64 * 1024
+        self.BODY_TAIL_BYTES = 4 * 1024
         self.service = None
+        self.creds = None
+        # httplib2 connections are not thread-safe, so each thread gets its own
+        self._thread_local = threading.local()
+        # Label name -> label ID, filled from a single labels().list() on first use
+        self._label_cache = None
+        # Messages fetched by get_messages_details_batch that the caller has not
+        # released with forget_messages yet, least recently used first. This only
+        # matters when a run is aborted part way: the next run re-lists the
+        # unprocessed emails and gets them from here instead of Gmail. Entries
+        # hold only the parts get_header(s) and get_email_body read.
+        self.MESSAGE_CACHE_SIZE = 512
+        self._message_cache = OrderedDict()
+        self._message_cache_lock = threading.Lock()
         self.authenticate()
     
     def authenticate(self):
@@ -36,17 +71,26 @@ class GmailClient:
             with open('token.pickle', 'wb') as token:
                 pickle.dump(creds, token)
         
+        self.creds = creds
         self.service = build('gmail', 'v1', credentials=creds)
         return self.service is not None
     
-    def get_unread_messages(self, max_results=500):
-        """Get unread messages from Gmail inbox, sorted by date (newest first)"""
+    def _thread_http(self):
+        """Get an authorized HTTP connection owned by the calling thread"""
+        if not hasattr(self._thread_local, 'http'):
+            # build_http sets the same timeout the service's own connection uses,
+            # so a stalled connection can't block a worker forever
+            self._thread_local.http = google_auth_httplib2.AuthorizedHttp(self.creds, http=build_http())
+        return self._thread_local.http
+    
+    def get_unread_messages(self, max_results=500, query='is:unread'):
+        """Get messages matching a Gmail search query (unread by default), newest first"""
         if not self.service:
             raise Exception("Gmail API service not initialized")
         
         results = self.service.users().messages().list(
             userId='me',
-            q='is:unread',
+            q=query,
             maxResults=max_results
         ).execute()
         
@@ -57,7 +101,7 @@ class GmailClient:
             page_token = results['nextPageToken']
             results = self.service.users().messages().list(
                 userId='me',
-                q='is:unread',
+                q=query,
                 maxResults=max_results,
                 pageToken=page_token
             ).execute()
@@ -71,11 +115,176 @@ class GmailClient:
             raise Exception("Gmail API service not initialized")
         
         message = self.service.users().messages().get(
-            userId='me', id=message_id
+            userId='me', id=message_id, format='full', fields=self.MESSAGE_FIELDS
+        ).execute()
+        
+        return message
+    
+    def _get_cached_message(self, message_id):
+        """Get a message from the cache, or None if it isn't cached"""
+        with self._message_cache_lock:
+            message = self._message_cache.get(message_id)
+            if message is not None:
+                self._message_cache.move_to_end(message_id)
+            return message
+    
+    def _cache_message(self, message_id, message):
+        """Add a message to the cache, evicting the least recently used ones"""
+        message = self._cacheable_message(message)
+        with self._message_cache_lock:
+            self._message_cache[message_id] = message
+            self._message_cache.move_to_end(message_id)
+            while len(self._message_cache) > self.MESSAGE_CACHE_SIZE:
+                self._message_cache.popitem(last=False)
+    
+    def forget_messages(self, message_ids):
+        """Drop messages from the cache once the caller is done with them"""
+        with self._message_cache_lock:
+            for message_id in message_ids:
+                self._message_cache.pop(message_id, None)
+    
+    def _cacheable_message(self, message):
+        """
+        Copy a message with only the parts get_header(s) and get_email_body read
+        
+        Drops the data of non-plain-text parts (such as text/html) and of
+        nested parts, which are never read but can be large.
+        """
+        payload = message['payload']
+        cached_payload = {'headers': payload['headers']}
+        
+        if 'parts' in payload:
+            # Keep 'parts' even if empty, so get_email_body takes the same branch
+            cached_payload['parts'] = [
+                {'mimeType': part['mimeType'], 'body': part.get('body', {})}
+                for part in payload['parts']
+                if part['mimeType'] == 'text/plain'
+            ]
+        elif 'body' in payload:
+            cached_payload['body'] = payload['body']
+        
+        return {'id': message['id'], 'payload': cached_payload}
+    
+    def get_message_metadata(self, message_id, header_names=('From', 'Subject', 'Date')):
+        """Get only the given headers of a specific message, without its body"""
+        if not self.service:
+            raise Exception("Gmail API service not initialized")
+        
+        message = self.service.users().messages().get(
+            userId='me',
+            id=message_id,
+            format='metadata',
+            metadataHeaders=list(header_names),
+            fields='id,payload/headers'
         ).execute()
         
         return message
     
+    def _execute_batch(self, requests):
+        """
+        Execute API requests using batched HTTP requests
+        
+        requests: Dictionary mapping a unique request ID to an API request
+        
+        Returns a dictionary mapping each request ID to its response
+        """
+        responses = {}
+        pending = dict(requests)
+        
+        for attempt in range(BATCH_RETRIES + 1):
+            retry = {}
+            errors = []
+            can_retry = attempt < BATCH_RETRIES
+            
+            def collect(request_id, response, exception):
+                if exception is None:
+                    responses[request_id] = response
+                elif can_retry and self._is_retryable(exception):
+                    retry[request_id] = pending[request_id]
+                else:
+                    errors.append(exception)
+            
+            # Gmail accepts up to 100 calls in a single batch request
+            request_items = list(pending.items())
+            for start in range(0, len(request_items), 100):
+                chunk = request_items[start:start + 100]
+                batch = self.service.new_batch_http_request(callback=collect)
+                for request_id, request in chunk:
+                    batch.add(request, request_id=request_id)
+                try:
+                    # Use a per-thread connection so batches can run from worker threads
+                    batch.execute(http=self._thread_http())
+                except HttpError as e:
+                    # The whole batch was rejected, so retry every call in it
+                    if not (can_retry and self._is_retryable(e)):
+                        raise
+                    retry.update((request_id, request) for request_id, request in chunk
+                                 if request_id not in responses)
+            
+            if errors:
+                raise errors[0]
+            if not retry:
+                break
+            
+            # Back off exponentially, with jitter so parallel workers spread out
+            time.sleep(2 ** attempt + random.random())
+            pending = retry
+        
+        return responses
+    
+    def _is_retryable(self, exception):
+        """Check whether a failed API call is worth retrying"""
+        if not isinstance(exception, HttpError):
+            return False
+        if exception.resp.status in RETRYABLE_STATUSES:
+            return True
+        # Other 403s, such as permission errors, won't succeed on retry
+        return exception.resp.status == 403 and self._is_rate_limit_error(exception)
+    
+    def _is_rate_limit_error(self, exception):
+        """Check whether an HttpError names a rate-limit reason"""
+        details = getattr(exception, 'error_details', None)
+        if isinstance(details, list):
+            return any(isinstance(detail, dict) and detail.get('reason') in RATE_LIMIT_REASONS
+                       for detail in details)
+        
+        # Older googleapiclient versions only expose the error message
+        reason = str(exception.reason).replace(' ', '').lower()
+        return any(rate_limit_reason.lower() in reason for rate_limit_reason in RATE_LIMIT_REASONS)
+    
+    def get_messages_details_batch(self, message_ids):
+        """
+        Get full details of several messages using batched HTTP requests
+        
+        Safe to call from several threads at once.
+        
+        Returns a dictionary mapping each message ID to its message
+        """
+        if not self.service:
+            raise Exception("Gmail API service not initialized")
+        
+        messages = {}
+        missing_ids = []
+        for message_id in message_ids:
+            message = self._get_cached_message(message_id)
+            if message is not None:
+                messages[message_id] = message
+            else:
+                missing_ids.append(message_id)
+        
+        fetched = self._execute_batch({
+            message_id: self.service.users().messages().get(
+                userId='me', id=message_id, format='full', fields=self.MESSAGE_FIELDS
+            )
+            for message_id in missing_ids
+        })
+        
+        for message_id, message in fetched.items():
+            self._cache_message(message_id, message)
+        messages.update(fetched)
+        
+        return messages
+    
     def get_header(self, message, header_name):
         """Extract a specific header value from a message"""
         headers = message['payload']['headers']
@@ -84,19 +293,52 @@ class GmailClient:
                 return header['value']
         return ""
     
+    def get_headers(self, message):
+        """Build a header name -> value dictionary for a message in one pass"""
+        # Reversed so the first occurrence of a repeated header wins, as in get_header
+        return {header['name']: header['value'] for header in reversed(message['payload']['headers'])}
+    
     def get_email_body(self, message):
         """Extract the body text from an email message"""
         if 'parts' in message['payload']:
             for part in message['payload']['parts']:
                 if part['mimeType'] == 'text/plain':
-                    if 'data' in part['body']:
+                    # Partial responses omit 'body' for parts without inline data
+                    if 'data' in part.get('body', {}):
                         data = part['body']['data']
-                        return base64.urlsafe_b64decode(data).decode('utf-8')
+                        return self._decode_body_data(data)
         elif 'body' in message['payload'] and 'data' in message['payload']['body']:
             data = message['payload']['body']['data']
-            return base64.urlsafe_b64decode(data).decode('utf-8')
+            return self._decode_body_data(data)
         return ""
     
+    def _decode_body_data(self, data):
+        """
+        Decode base64url body data
+        
+        Bodies longer than MAX_BODY_BYTES are cut to their first MAX_BODY_BYTES
+        and last BODY_TAIL_BYTES, joined by a newline.
+        """
+        # Every 4 base64 characters decode to 3 bytes, so cut before decoding
+        head_chars = self.MAX_BODY_BYTES // 3 * 4
+        tail_chars = self.BODY_TAIL_BYTES // 3 * 4
+        if len(data) <= head_chars + tail_chars:
+            return self._decode_base64url(data)
+        
+        # Start the tail on a 4-character boundary so it decodes on its own
+        tail_start = len(data) - tail_chars
+        tail_start += -tail_start % 4
+        return self._decode_base64url(data[:head_chars]) + '\n' + self._decode_base64url(data[tail_start:])
+    
+    def _decode_base64url(self, data):
+        """Decode a base64url string to text"""
+        # Map the URL-safe alphabet to the standard one and decode in C
+        data = data.translate(URLSAFE_TO_STANDARD_BASE64)
+        data += '=' * (-len(data) % 4)
+        
+        # A cut may split a multi-byte character at either end
+        return binascii.a2b_base64(data).decode('utf-8', errors='replace')
+    
     def mark_as_important(self, message_id):
         """Mark a message as important"""
         if not self.service:
@@ -124,17 +366,11 @@ class GmailClient:
         if not self.service:
             raise Exception("Gmail API service not initialized")
         
+        # Add SPAM and remove from inbox in a single call
         self.service.users().messages().modify(
             userId='me',
             id=message_id,
-            body={'addLabelIds': ['SPAM']}
-        ).execute()
-        
-        # Also remove from inbox
-        self.service.users().messages().modify(
-            userId='me',
-            id=message_id,
-            body={'removeLabelIds': ['INBOX']}
+            body={'addLabelIds': ['SPAM'], 'removeLabelIds': ['INBOX']}
         ).execute()
     
     def trash_message(self, message_id):
@@ -146,30 +382,64 @@ class GmailClient:
             userId='me', id=message_id
         ).execute()
     
-    def create_label(self, label_name):
-        """Create a new label if it doesn't exist already"""
+    def batch_modify_messages(self, message_ids, add_label_ids=None, remove_label_ids=None):
+        """Add and/or remove labels on several messages at once"""
+        if not self.service:
+            raise Exception("Gmail API service not initialized")
+        
+        # batchModify accepts up to 1000 message IDs per call
+        for start in range(0, len(message_ids), 1000):
+            body = {'ids': message_ids[start:start + 1000]}
+            if add_label_ids:
+                body['addLabelIds'] = add_label_ids
+            if remove_label_ids:
+                body['removeLabelIds'] = remove_label_ids
+            
+            self.service.users().messages().batchModify(
+                userId='me', body=body
+            ).execute()
+    
+    def trash_messages(self, message_ids):
+        """Move several messages to trash using batched HTTP requests"""
+        if not self.service:
+            raise Exception("Gmail API service not initialized")
+        
+        # There is no bulk trash call, so pipeline the individual requests
+        self._execute_batch({
+            message_id: self.service.users().messages().trash(userId='me', id=message_id)
+            for message_id in message_ids
+        })
+    
+    def create_label(self, label_name, label_list_visibility='labelShow', message_list_visibility='show'):
+        """
+        Create a new label if it doesn't exist already
+        
+        The visibility settings only apply when the label is created; use
+        'labelHide' and 'hide' for labels that are only for bookkeeping.
+        """
         if not self.service:
             raise Exception("Gmail API service not initialized")
         
         # First check if the label already exists
-        results = self.service.users().labels().list(userId='me').execute()
-        labels = results.get('labels', [])
+        if self._label_cache is None:
+            results = self.service.users().labels().list(userId='me').execute()
+            self._label_cache = {label['name']: label['id'] for label in results.get('labels', [])}
         
-        for label in labels:
-            if label['name'] == label_name:
-                return label['id']
+        if label_name in self._label_cache:
+            return self._label_cache[label_name]
         
         # Create the label if it doesn't exist
         label_object = {
             'name': label_name,
-            'labelListVisibility': 'labelShow',
-            'messageListVisibility': 'show'
+            'labelListVisibility': label_list_visibility,
+            'messageListVisibility': message_list_visibility
         }
         
         created_label = self.service.users().labels().create(
             userId='me', body=label_object
         ).execute()
         
+        self._label_cache[label_name] = created_label['id']
         return created_label['id']
     
     def apply_label(self, message_id, label_name):
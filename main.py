@@ -1,4 +1,11 @@
 import os
+
+# TensorFlow reads these when it is first imported (in the background, see
+# GmailAIFilterUI), so set them before anything can import it
+os.environ.setdefault('TF_ENABLE_ONEDNN_OPTS', '1')  # oneDNN kernels for the dense layers
+os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')  # Only log TensorFlow errors
+
+import importlib.util
 import tkinter as tk
 from tkinter import ttk, messagebox
 import sys
@@ -13,16 +20,17 @@ def check_dependencies():
         'google-auth-oauthlib': 'google_auth_oauthlib',
         'tensorflow': 'tensorflow',
         'scikit-learn': 'sklearn',
+        'scipy': 'scipy',
         'pandas': 'pandas',
         'numpy': 'numpy'
     }
     
     missing_packages = []
     
+    # find_spec only locates the package, so heavy packages like TensorFlow
+    # are not imported just to check that they are installed
     for package, import_name in package_imports.items():
-        try:
-            __import__(import_name)
-        except ImportError:
+        if importlib.util.find_spec(import_name) is None:
             missing_packages.append(package)
     
     return missing_packages
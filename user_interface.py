@@ -1,8 +1,6 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import threading
-import time
-from email_processor import EmailProcessor
 
 class GmailAIFilterUI:
     def __init__(self, root):
@@ -12,18 +10,64 @@ class GmailAIFilterUI:
         self.root.geometry("800x600")
         self.root.minsize(800, 600)
         
-        # Initialize the email processor
-        self.email_processor = EmailProcessor()
+        # The email processor is created in the background (see _init_processor)
+        self.email_processor = None
         
         # Create UI elements
         self._create_widgets()
         
-        # Processing flag
-        self.is_processing = False
+        # Held while emails are being processed, so only one run happens at a time
+        self._proc_lock = threading.Lock()
         
-        # Auto-refresh thread
-        self.auto_refresh_enabled = False
-        self.auto_refresh_thread = None
+        # Number of results shown in the emails list for the current run
+        self._shown_count = 0
+        
+        # Statistics dialog, created on first use (see show_stats)
+        self._stats_dialog = None
+        self._stats_vars = {}
+        self._stats_sections = {}
+        
+        # Pending auto-refresh callback from root.after, or None when off
+        self._auto_refresh_job = None
+        
+        # Controls that need the email processor stay disabled until it is ready
+        self._processor_controls = (
+            self.process_button, self.auto_refresh_check, self.retrain_button, self.stats_button
+        )
+        for control in self._processor_controls:
+            control.configure(state=tk.DISABLED)
+        self.status_var.set("Loading model...")
+        
+        # Load TensorFlow, the model and Gmail credentials without blocking the window
+        threading.Thread(target=self._init_processor, daemon=True).start()
+    
+    def _init_processor(self):
+        """Background thread that creates the email processor"""
+        try:
+            # Imported here because it pulls in TensorFlow, which is slow to import
+            from email_processor import EmailProcessor
+            
+            email_processor = EmailProcessor()
+            
+            # Run the model once now, rather than on the first Process click
+            email_processor.warm_up()
+            
+            # Hand the processor over in the main thread
+            self.root.after(0, lambda: self._processor_ready(email_processor))
+            
+        except Exception as e:
+            # Show error message in the main thread
+            error_message = f"Failed to initialize: {str(e)}"
+            self.root.after(0, lambda: messagebox.showerror("Error", error_message))
+            self.root.after(0, lambda: self.status_var.set("Initialization failed"))
+    
+    def _processor_ready(self, email_processor):
+        """Called in the main thread once the email processor is created"""
+        self.email_processor = email_processor
+        
+        for control in self._processor_controls:
+            control.configure(state=tk.NORMAL)
+        self.status_var.set("Ready")
     
     def _create_widgets(self):
         """Create all UI widgets"""
@@ -49,13 +93,21 @@ class GmailAIFilterUI:
         # Create a variable to store the number of emails
         self.email_count_var = tk.StringVar(value="20")  # Default value
         
-        # Create a spinbox for selecting number of emails
+        # Keep the parsed count in sync with the spinbox so readers don't parse it
+        self._email_count = 20
+        self.email_count_var.trace_add('write', self._on_email_count_changed)
+        
+        # Create a spinbox for selecting number of emails, rejecting any
+        # keystroke that would make the count invalid
+        email_count_vcmd = (self.root.register(self._validate_email_count), '%P')
         self.email_count_spinbox = ttk.Spinbox(
             email_count_frame,
             from_=1,
             to=500,
             width=5,
-            textvariable=self.email_count_var
+            textvariable=self.email_count_var,
+            validate='key',
+            validatecommand=email_count_vcmd
         )
         self.email_count_spinbox.pack(side=tk.LEFT, padx=5)
         
@@ -128,39 +180,48 @@ class GmailAIFilterUI:
                                    text="Double-click on an email to provide feedback and improve the AI model.")
         feedback_label.pack(fill=tk.X)
     
+    def _validate_email_count(self, value):
+        """Allow only an empty spinbox (while typing) or a count from 1 to 500"""
+        # isdigit alone accepts characters such as '²' that int() rejects
+        return value == "" or (value.isascii() and value.isdigit() and 1 <= int(value) <= 500)
+    
+    def _on_email_count_changed(self, *args):
+        """Update the parsed email count when the spinbox changes"""
+        value = self.email_count_var.get()
+        # Keep the previous count while the spinbox is cleared for typing
+        if value:
+            self._email_count = int(value)
+    
     def process_emails(self):
         """Process unread emails from Gmail inbox"""
-        if self.is_processing:
+        # Check and claim the lock in one step; released in _processing_complete
+        if not self._proc_lock.acquire(blocking=False):
             return
         
-        try:
-            # Get the number of emails to process
-            email_count = int(self.email_count_var.get())
-            # Validate the input
-            if email_count < 1:
-                email_count = 1
-            elif email_count > 500:
-                email_count = 500
-        except ValueError:
-            # If invalid input, use default
-            email_count = 20
-            self.email_count_var.set("20")
-            
-        self.is_processing = True
+        # Get the number of emails to process (kept valid by the spinbox)
+        email_count = self._email_count
+        
         self.status_var.set(f"Processing up to {email_count} unread emails...")
         self.process_button.configure(state=tk.DISABLED)
         
+        # Results are added to the list as each batch is classified
+        self._clear_emails_list()
+        
         # Run in a separate thread to avoid blocking the UI
         threading.Thread(target=self._process_emails_thread, args=(email_count,), daemon=True).start()
     
     def _process_emails_thread(self, email_count):
         """Background thread for processing emails"""
         try:
-            # Process up to specified number of unread emails
-            results = self.email_processor.process_unread_emails(max_emails=email_count)
+            # Process up to specified number of unread emails, showing each
+            # batch of results in the main thread as soon as it is ready
+            results = self.email_processor.process_unread_emails(
+                max_emails=email_count,
+                on_results=lambda batch_results: self.root.after(0, self._append_email_rows, batch_results)
+            )
             
             # Update the UI in the main thread
-            self.root.after(0, lambda: self._update_emails_list(results))
+            self.root.after(0, lambda: self._show_processing_summary(results))
             
         except Exception as e:
             # Show error message in the main thread
@@ -171,41 +232,49 @@ class GmailAIFilterUI:
     
     def _processing_complete(self):
         """Called when email processing is complete"""
-        self.is_processing = False
+        self._proc_lock.release()
         self.status_var.set("Ready")
         self.process_button.configure(state=tk.NORMAL)
     
-    def _update_emails_list(self, results):
-        """Update the emails treeview with processing results"""
-        # Clear existing items
-        for item in self.emails_tree.get_children():
-            self.emails_tree.delete(item)
-        
-        # Add new items
-        for result in results:
-            # Format the importance score as a percentage
-            importance = f"{result['importance_score']:.0%}"
-            
-            _, spam_score = self.email_processor.email_classifier.predict_spam_likelihood(
-            self.email_processor.extract_email_features(
-                self.email_processor.gmail_client.get_message_details(result['message_id'])
-                )
-            )   
-            spam = f"{spam_score:.0%}"
-
-            # Add the item to the treeview
-            self.emails_tree.insert(
-                "", 
-                tk.END, 
-                values=(
-                    result['sender'], 
-                    result['subject'], 
-                    importance, 
-                    spam,
-                    result['action']
+    def _clear_emails_list(self):
+        """Remove all emails from the treeview"""
+        # Clear existing items in a single call
+        children = self.emails_tree.get_children()
+        if children:
+            self.emails_tree.delete(*children)
+        self._shown_count = 0
+    
+    def _append_email_rows(self, results):
+        """Add a batch of processing results to the emails treeview"""
+        # Format all rows first so formatting isn't interleaved with Tk calls
+        rows = [
+            (
+                (
+                    result.sender,
+                    result.subject,
+                    f"{result.importance_score:.0%}",
+                    f"{result.spam_score:.0%}",
+                    result.action
                 ),
-                tags=(result['message_id'],)
+                result.message_id
             )
+            for result in results
+        ]
+        
+        # Rows are keyed by message ID so _show_processing_summary can reorder them
+        for values, message_id in rows:
+            self.emails_tree.insert("", tk.END, iid=message_id, values=values, tags=(message_id,))
+        
+        # Show progress while the rest are still being processed
+        self._shown_count += len(rows)
+        self.status_var.set(f"Processed {self._shown_count} emails so far...")
+    
+    def _show_processing_summary(self, results):
+        """Put the emails treeview in Gmail's order and set the final status"""
+        # Batches are shown in the order their fetches finish, so move each
+        # row to the position of its result
+        for index, result in enumerate(results):
+            self.emails_tree.move(result.message_id, "", index)
         
         # Set status message
         if results:
@@ -215,6 +284,11 @@ class GmailAIFilterUI:
     
     def on_email_double_click(self, event):
         """Handle double-clicking on an email in the list"""
+        # Feedback updates state the processing thread is using, so wait for it
+        if self._proc_lock.locked():
+            self.status_var.set("Feedback can be given once processing has finished")
+            return
+        
         # Get the selected item
         selection = self.emails_tree.selection()
         if not selection:
@@ -321,73 +395,111 @@ class GmailAIFilterUI:
         """Show application statistics"""
         stats = self.email_processor.get_stats()
         
-        # Create a dialog window
-        dialog = tk.Toplevel(self.root)
-        dialog.title("Application Statistics")
-        dialog.geometry("400x300")
-        dialog.transient(self.root)
-        
-        # Create dialog content
-        frame = ttk.Frame(dialog, padding=10)
-        frame.pack(fill=tk.BOTH, expand=True)
+        # The dialog is created once and hidden when closed, so reopening it
+        # only refreshes its contents
+        if self._stats_dialog is None:
+            self._create_stats_dialog()
+        else:
+            self._stats_dialog.deiconify()
+            self._stats_dialog.lift()
         
         # Stats
-        ttk.Label(frame, text="Email Statistics:", font=("", 10, "bold")).pack(anchor=tk.W, pady=(0, 5))
-        ttk.Label(frame, text=f"Processed Emails: {stats['processed_emails']}").pack(anchor=tk.W)
-        ttk.Label(frame, text=f"Unique Senders: {stats['unique_senders']}").pack(anchor=tk.W)
+        self._stats_vars['processed_emails'].set(f"Processed Emails: {stats['processed_emails']}")
+        self._stats_vars['unique_senders'].set(f"Unique Senders: {stats['unique_senders']}")
         
-        # Actions breakdown
+        # Actions breakdown, one line per action
+        actions_text = ""
         if 'actions' in stats and stats['actions']:
-            ttk.Label(frame, text="\nActions Taken:", font=("", 10, "bold")).pack(anchor=tk.W, pady=(10, 5))
-            for action, count in stats['actions'].items():
-                ttk.Label(frame, text=f"{action.capitalize()}: {count}").pack(anchor=tk.W)
+            actions_text = "\n".join(f"{action.capitalize()}: {count}" for action, count in stats['actions'].items())
+        self._show_stats_section('actions', actions_text)
         
         # Model stats
+        model_text = ""
         if 'model_stats' in stats and stats['model_stats']:
             ms = stats['model_stats']
-            ttk.Label(frame, text="\nModel Training:", font=("", 10, "bold")).pack(anchor=tk.W, pady=(10, 5))
-            ttk.Label(frame, text=f"Training Examples: {ms.get('total_examples', 0)}").pack(anchor=tk.W)
+            lines = [f"Training Examples: {ms.get('total_examples', 0)}"]
             
             if 'important_count' in ms and 'unimportant_count' in ms:
-                ttk.Label(frame, text=f"Important Emails: {ms['important_count']}").pack(anchor=tk.W)
-                ttk.Label(frame, text=f"Not Important Emails: {ms['unimportant_count']}").pack(anchor=tk.W)
+                lines.append(f"Important Emails: {ms['important_count']}")
+                lines.append(f"Not Important Emails: {ms['unimportant_count']}")
             
             if 'important_ratio' in ms:
                 ratio = ms['important_ratio'] * 100
-                ttk.Label(frame, text=f"Important Email Ratio: {ratio:.1f}%").pack(anchor=tk.W)
+                lines.append(f"Important Email Ratio: {ratio:.1f}%")
+            
+            model_text = "\n".join(lines)
+        self._show_stats_section('model_stats', model_text)
+    
+    def _show_stats_section(self, key, text):
+        """Show a statistics breakdown with the given text, or hide it if the text is empty"""
+        header, body = self._stats_sections[key]
+        
+        if text:
+            self._stats_vars[key].set(text)
+            if not header.winfo_manager():
+                header.pack(anchor=tk.W, pady=(10, 5))
+                body.pack(anchor=tk.W)
+        else:
+            header.pack_forget()
+            body.pack_forget()
+    
+    def _create_stats_dialog(self):
+        """Create the statistics dialog, with labels bound to self._stats_vars"""
+        # Create a dialog window
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Application Statistics")
+        dialog.geometry("400x300")
+        dialog.transient(self.root)
+        
+        # Closing only hides the dialog so it can be shown again
+        dialog.protocol("WM_DELETE_WINDOW", dialog.withdraw)
+        
+        # Create dialog content
+        frame = ttk.Frame(dialog, padding=10)
+        frame.pack(fill=tk.BOTH, expand=True)
+        
+        # Stats
+        self._stats_vars = {
+            'processed_emails': tk.StringVar(),
+            'unique_senders': tk.StringVar(),
+            'actions': tk.StringVar(),
+            'model_stats': tk.StringVar()
+        }
+        ttk.Label(frame, text="Email Statistics:", font=("", 10, "bold")).pack(anchor=tk.W, pady=(0, 5))
+        ttk.Label(frame, textvariable=self._stats_vars['processed_emails']).pack(anchor=tk.W)
+        ttk.Label(frame, textvariable=self._stats_vars['unique_senders']).pack(anchor=tk.W)
+        
+        # Actions and model breakdowns, each in its own frame so showing and
+        # hiding them (see _show_stats_section) keeps them in order
+        self._stats_sections = {}
+        for key, title in (('actions', "\nActions Taken:"), ('model_stats', "\nModel Training:")):
+            section = ttk.Frame(frame)
+            section.pack(fill=tk.X)
+            self._stats_sections[key] = (
+                ttk.Label(section, text=title, font=("", 10, "bold")),
+                ttk.Label(section, textvariable=self._stats_vars[key], justify=tk.LEFT)
+            )
         
         # Close button
-        ttk.Button(frame, text="Close", command=dialog.destroy).pack(pady=(15, 0))
+        ttk.Button(frame, text="Close", command=dialog.withdraw).pack(pady=(15, 0))
+        
+        self._stats_dialog = dialog
     
     def toggle_auto_refresh(self):
         """Toggle the auto-refresh feature"""
         if self.auto_refresh_var.get():
-            # Start auto-refresh
-            self.auto_refresh_enabled = True
-            self.auto_refresh_thread = threading.Thread(target=self._auto_refresh_loop, daemon=True)
-            self.auto_refresh_thread.start()
+            # Start auto-refresh: process emails again in 5 minutes
+            if self._auto_refresh_job is None:
+                self._auto_refresh_job = self.root.after(300_000, self._auto_refresh_tick)
         else:
             # Stop auto-refresh
-            self.auto_refresh_enabled = False
+            if self._auto_refresh_job is not None:
+                self.root.after_cancel(self._auto_refresh_job)
+                self._auto_refresh_job = None
     
-    def _auto_refresh_loop(self):
-        """Background thread for auto-refreshing"""
-        while self.auto_refresh_enabled:
-            # Wait for 5 minutes
-            for _ in range(300):  # 300 seconds = 5 minutes
-                if not self.auto_refresh_enabled:
-                    break
-                time.sleep(1)
-            
-            # Process emails if auto-refresh is still enabled
-            if self.auto_refresh_enabled and not self.is_processing:
-                try:
-                    # Get the number of emails to process from the spinbox
-                    email_count = int(self.email_count_var.get())
-                    if email_count < 1 or email_count > 500:
-                        email_count = 20
-                except ValueError:
-                    email_count = 20
-                
-                # Process emails with the current count setting
-                self.root.after(0, self.process_emails)
\ No newline at end of file
+    def _auto_refresh_tick(self):
+        """Process emails and schedule the next auto-refresh"""
+        # Process emails (skipped by process_emails if a run is in progress)
+        self.process_emails()
+        
+        self._auto_refresh_job = self.root.after(300_000, self._auto_refresh_tick)
\ No newline at end of file